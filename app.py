@@ -1,13 +1,22 @@
 import streamlit as st
 import pandas as pd
-from fuzzywuzzy import fuzz
+import numpy as np
+from rapidfuzz import fuzz, process, utils
+from sentence_transformers import SentenceTransformer
+import faiss
 import google.generativeai as genai
 import os
-import re
+import glob
+import hashlib
+import threading
+import time
+from collections import OrderedDict, defaultdict, deque
 
-# Initialize session state for conversation history
+# Initialize session state for conversation history as a bounded deque of
+# (role, message) tuples so only the most recent turns are kept and re-rendered
+HISTORY_LIMIT = 50
 if 'history' not in st.session_state:
-    st.session_state.history = []
+    st.session_state.history = deque(maxlen=HISTORY_LIMIT)
 
 # Configure Gemini API (requires API key)
 GEMINI_API_KEY = os.getenv("GEMINI_API_KEY")
@@ -25,48 +34,46 @@ def load_data():
             st.error("Error: kepler_data.xlsx file not found in the app directory. Please ensure it's uploaded to the GitHub repository.")
             return {}
         
-        xls = pd.ExcelFile('kepler_data.xlsx')
         sheets = ['Draft', 'Admissions', 'Orientation', 'Programs']
+        # Parse the whole workbook in one pass with the Rust-based calamine reader,
+        # reading cells as strings so no later astype(str) pass is needed
+        frames = pd.read_excel('kepler_data.xlsx', sheet_name=None, engine='calamine', dtype=str)
         data = {}
         for sheet in sheets:
             try:
-                # Read first few rows to inspect headers
-                df = pd.read_excel(xls, sheet_name=sheet, nrows=5)
+                if sheet not in frames:
+                    st.error(f"Error in sheet '{sheet}': Sheet not found in kepler_data.xlsx.")
+                    continue
+                df = frames[sheet]
                 # Strip whitespace from column names
                 df.columns = [col.strip() if isinstance(col, str) else col for col in df.columns]
                 actual_columns = df.columns.tolist()
                 st.write(f"Debug: Columns in sheet '{sheet}' after stripping whitespace: {actual_columns}")
                 
                 # Check for required columns (case-insensitive, after stripping)
-                columns_lower = [col.lower() for col in actual_columns]
-                questions_col = next((col for col in actual_columns if col.lower().strip() == 'questions'), None)
-                answers_col = next((col for col in actual_columns if col.lower().strip() == 'answers'), None)
+                questions_col = next((col for col in actual_columns if isinstance(col, str) and col.lower() == 'questions'), None)
+                answers_col = next((col for col in actual_columns if isinstance(col, str) and col.lower() == 'answers'), None)
                 
                 if not questions_col or not answers_col:
                     st.error(f"Error in sheet '{sheet}': Expected columns 'Questions' and 'Answers' (case-insensitive, no whitespace). Found: {actual_columns}")
                     continue
                 
-                # Read full sheet with correct header
-                df = pd.read_excel(xls, sheet_name=sheet)
-                # Strip whitespace from column names again
-                df.columns = [col.strip() if isinstance(col, str) else col for col in df.columns]
                 # Rename columns to standard 'Questions' and 'Answers' if needed
                 if questions_col != 'Questions':
                     df = df.rename(columns={questions_col: 'Questions'})
                 if answers_col != 'Answers':
                     df = df.rename(columns={answers_col: 'Answers'})
                 
-                # Clean data
-                df = df.dropna(subset=['Questions', 'Answers'])
-                df['Questions'] = df['Questions'].astype(str).str.strip().replace('', None)
-                df['Answers'] = df['Answers'].astype(str).str.strip().replace('', None)
-                df = df.dropna(subset=['Questions', 'Answers'])
+                # Clean data on Arrow-backed strings so strip runs as a vectorized
+                # Arrow kernel, treat blank cells as missing, drop in one pass
+                df = df[['Questions', 'Answers']].astype('string[pyarrow]')
+                df = df.apply(lambda col: col.str.strip()).replace('', np.nan).dropna()
                 
                 if df.empty:
                     st.warning(f"Warning: No valid data in sheet '{sheet}' after cleaning.")
                     continue
                 
-                data[sheet] = df[['Questions', 'Answers']].to_dict('records')
+                data[sheet] = df.reset_index(drop=True)
             except Exception as e:
                 st.error(f"Error processing sheet '{sheet}': {e}")
                 continue
@@ -87,38 +94,257 @@ def load_model():
         st.error(f"Error loading Gemini model: {e}")
         return None
 
-# Find the best matching question
-def find_best_match(question, data, threshold=80):
-    best_match = None
-    highest_score = 0
-    for sheet, qa_pairs in data.items():
-        for qa in qa_pairs:
-            q = qa['Questions']
-            if not isinstance(q, str):
-                continue
-            score = fuzz.token_sort_ratio(question.lower(), q.lower())
-            if score > highest_score and score >= threshold:
-                highest_score = score
-                best_match = (qa['Answers'], sheet)
-    return best_match, highest_score
+# Normalize text into the token-sorted form token_sort_ratio compares
+def sort_tokens(text):
+    return " ".join(sorted(utils.default_process(text).split()))
+
+# Split normalized text into 3-character shingles; short tokens are kept whole
+def shingles(text):
+    grams = set()
+    for token in text.split():
+        if len(token) <= 3:
+            grams.add(token)
+        else:
+            grams.update(token[i:i + 3] for i in range(len(token) - 2))
+    return grams
+
+# Map each shingle to the corpus rows containing it
+def build_shingle_index(questions):
+    postings = defaultdict(list)
+    for idx, q in enumerate(questions):
+        for gram in shingles(q):
+            postings[gram].append(idx)
+    return {gram: np.array(rows, dtype=np.int32) for gram, rows in postings.items()}
+
+# Version of the cleaned corpus format; bump whenever load_data's parsing or
+# cleaning changes so Parquet caches written by older code are not reused
+CORPUS_CACHE_VERSION = 2
+
+# Load the flattened Questions/Answers/Sheet frame, reusing a Parquet copy
+# of the parsed workbook while kepler_data.xlsx is unchanged
+def load_qa_frame():
+    if not os.path.exists('kepler_data.xlsx'):
+        # load_data reports the missing workbook to the user
+        load_data()
+        return pd.DataFrame(columns=['Questions', 'Answers', 'Sheet'])
+    mtime = os.stat('kepler_data.xlsx').st_mtime_ns
+    cache_path = f"kepler_cache_v{CORPUS_CACHE_VERSION}_{mtime}.parquet"
+    if os.path.exists(cache_path):
+        try:
+            return pd.read_parquet(cache_path)
+        except Exception as e:
+            st.warning(f"Warning: Ignoring unreadable cache {cache_path}: {e}")
+
+    data = load_data()
+    if not data:
+        return pd.DataFrame(columns=['Questions', 'Answers', 'Sheet'])
+    frame = pd.concat([df.assign(Sheet=sheet) for sheet, df in data.items()], ignore_index=True)
+
+    try:
+        # Drop caches left behind by older versions of the workbook
+        for stale in glob.glob('kepler_cache_*.parquet'):
+            os.remove(stale)
+        frame.to_parquet(cache_path, compression='zstd', index=False)
+    except Exception as e:
+        st.warning(f"Warning: Could not write cache {cache_path}: {e}")
+    return frame
+
+# Lay the corpus out as parallel NumPy columns so matching is a single rapidfuzz call
+@st.cache_resource
+def load_corpus():
+    frame = load_qa_frame()
+    questions = np.array([sort_tokens(q) for q in frame['Questions']], dtype=object)
+    sheets = pd.Categorical(frame['Sheet'])
+    return {
+        'questions': questions,
+        'answers': frame['Answers'].to_numpy(dtype=object),
+        'sheet_ids': sheets.codes.astype(np.int8),
+        'sheet_names': list(sheets.categories),
+        'lengths': np.fromiter(map(len, questions), dtype=np.int32, count=len(questions)),
+        'index': build_shingle_index(questions),
+        # First row for each normalized question, for the exact-match fast path
+        'exact': {q: idx for idx, q in reversed(list(enumerate(questions)))},
+    }
+
+# Sentence encoder used for semantic question matching
+ENCODER_MODEL = 'sentence-transformers/all-MiniLM-L6-v2'
+
+@st.cache_resource
+def load_encoder():
+    try:
+        return SentenceTransformer(ENCODER_MODEL)
+    except Exception as e:
+        st.error(f"Error loading sentence encoder: {e}")
+        return None
+
+# Inner-product FAISS index over normalized question embeddings, in corpus
+# row order, persisted to disk while the questions and encoder are unchanged
+@st.cache_resource
+def load_semantic_index():
+    encoder = load_encoder()
+    if encoder is None:
+        return None
+    questions = load_qa_frame()['Questions'].tolist()
+    if not questions:
+        return None
+    # FAISS ids are corpus row positions, so the stored index is only valid
+    # for exactly these questions in this order, embedded by this encoder
+    digest = hashlib.sha256("\n".join(questions).encode('utf-8')).hexdigest()[:16]
+    model_slug = ENCODER_MODEL.rsplit('/', 1)[-1]
+    index_path = f"kepler_faiss_v{CORPUS_CACHE_VERSION}_{model_slug}_{digest}.index"
+    if os.path.exists(index_path):
+        try:
+            index = faiss.read_index(index_path)
+            if index.ntotal == len(questions):
+                return index
+        except Exception as e:
+            st.warning(f"Warning: Ignoring unreadable index {index_path}: {e}")
+
+    try:
+        embeddings = encoder.encode(questions, normalize_embeddings=True, convert_to_numpy=True)
+        index = faiss.IndexFlatIP(embeddings.shape[1])
+        index.add(embeddings.astype(np.float32))
+    except Exception as e:
+        st.error(f"Error building semantic index: {e}")
+        return None
+
+    try:
+        # Drop indexes built for older questions or encoders
+        for stale in glob.glob('kepler_faiss_*.index'):
+            os.remove(stale)
+        faiss.write_index(index, index_path)
+    except Exception as e:
+        st.warning(f"Warning: Could not write index {index_path}: {e}")
+    return index
+
+# Find the closest question by embedding cosine similarity
+def find_semantic_match(question, corpus, encoder, index, min_similarity=0.75):
+    if encoder is None or index is None or not question:
+        return None, 0
+    embedding = encoder.encode([question], normalize_embeddings=True, convert_to_numpy=True)
+    similarities, ids = index.search(embedding.astype(np.float32), 1)
+    idx = int(ids[0][0])
+    if idx < 0 or similarities[0][0] < min_similarity:
+        return None, 0
+    return (corpus['answers'][idx], corpus['sheet_names'][corpus['sheet_ids'][idx]]), round(float(similarities[0][0]) * 100)
+
+# Find a question whose normalized form is in the corpus verbatim
+def find_exact_match(question, corpus):
+    idx = corpus['exact'].get(sort_tokens(question))
+    if idx is None:
+        return None, 0
+    return (corpus['answers'][idx], corpus['sheet_names'][corpus['sheet_ids'][idx]]), 100
+
+# Number of shingle-ranked candidates rescored with fuzz.ratio per query
+MAX_RESCORED = 32
+
+# Find the best matching question; callers check find_exact_match first,
+# an exact question still scores 100 here if they do not
+def find_best_match(question, corpus, threshold=80):
+    query = sort_tokens(question)
+    if not query:
+        return None, 0
+    # Scores are rounded to integers, so anything that rounds up to the
+    # threshold still counts as a match
+    cutoff = threshold - 0.5
+    # Only rows sharing at least one shingle with the query can score well
+    postings = [corpus['index'][gram] for gram in shingles(query) if gram in corpus['index']]
+    if not postings:
+        return None, 0
+    candidates, shared = np.unique(np.concatenate(postings), return_counts=True)
+    # fuzz.ratio can never exceed 200 * min_len / (len_a + len_b), so skip
+    # candidates whose length alone rules them out before any edit distance
+    lengths = corpus['lengths'][candidates]
+    upper_bound = 200 * np.minimum(lengths, len(query)) / (lengths + len(query))
+    keep = upper_bound >= cutoff
+    candidates, shared = candidates[keep], shared[keep]
+    if not candidates.size:
+        return None, 0
+    # Cheap first stage: only the rows sharing the most shingles with the
+    # query go on to the exact scorer
+    if candidates.size > MAX_RESCORED:
+        candidates = candidates[np.argpartition(-shared, MAX_RESCORED - 1)[:MAX_RESCORED]]
+        candidates.sort()
+    # Score every remaining candidate in one call. fuzz.ratio is
+    # the normalized Indel similarity, computed with rapidfuzz's bit-parallel
+    # LCS over the pre-sorted tokens; uint8 scores keep the row small and
+    # below-cutoff candidates come back as 0
+    scores = process.cdist(
+        [query],
+        corpus['questions'][candidates],
+        scorer=fuzz.ratio,
+        score_cutoff=cutoff,
+        dtype=np.uint8,
+    )[0]
+    pos = int(np.argmax(scores))
+    score = int(scores[pos])
+    if not score or score < threshold:
+        return None, 0
+    idx = candidates[pos]
+    return (corpus['answers'][idx], corpus['sheet_names'][corpus['sheet_ids'][idx]]), score
 
 # Clean user input
 def clean_input(text):
     if not isinstance(text, str):
         return ""
-    text = text.strip()
-    text = re.sub(r'\s+', ' ', text)
-    return text
+    # split() with no separator strips and collapses whitespace in one C pass
+    return ' '.join(text.split())
+
+# Bounded LRU of generated answers, shared by every session and rerun
+class ResponseCache:
+    def __init__(self, maxsize=1024, ttl=86400):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
 
-# Generate response using Gemini
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            stored_at, value = entry
+            if time.monotonic() - stored_at > self.ttl:
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def put(self, key, value):
+        with self._lock:
+            self._entries[key] = (time.monotonic(), value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+@st.cache_resource
+def load_response_cache():
+    return ResponseCache()
+
+# Seconds to wait on a Gemini request before reporting an error
+GEMINI_TIMEOUT = 60
+
+# Generate response using Gemini, yielding text as it streams in
 def generate_gemini_response(model, question):
+    # Questions differing only in case or whitespace share one cached answer
+    cache_key = clean_input(question).lower()
+    cache = load_response_cache()
+    cached = cache.get(cache_key)
+    if cached is not None:
+        yield cached
+        return
     try:
         context = "Kepler College is a higher learning institution in Rwanda offering programs in Project Management, Business Analytics, and degrees through a partnership with Southern New Hampshire University (SNHU)."
         prompt = f"Question: {question}\nContext: {context}\nAnswer based on the context or general knowledge about Kepler College, but keep it concise and relevant."
-        response = model.generate_content(prompt)
-        return response.text
+        parts = []
+        # timeout bounds the request so a stalled call surfaces as an error
+        response = model.generate_content(prompt, stream=True, request_options={'timeout': GEMINI_TIMEOUT})
+        for chunk in response:
+            parts.append(chunk.text)
+            yield chunk.text
+        cache.put(cache_key, "".join(parts))
     except Exception as e:
-        return f"Error generating response: {e}"
+        yield f"Error generating response: {e}"
 
 # Main Streamlit app
 def main():
@@ -126,7 +352,9 @@ def main():
     st.write("Ask me anything about Kepler College! I’ll answer based on our dataset or use Gemini AI for additional insights.")
 
     # Load data and model
-    data = load_data()
+    corpus = load_corpus()
+    encoder = load_encoder()
+    semantic_index = load_semantic_index()
     gemini_model = load_model()
 
     # Input form
@@ -134,5 +362,35 @@ def main():
         user_question = st.text_input("Your Question:", placeholder="e.g., What programs does Kepler College offer?")
         submit_button = st.form_submit_button("Ask")
 
+    # Display conversation history
+    for role, message in st.session_state.history:
+        with st.chat_message(role):
+            st.markdown(message)
+
     if submit_button and user_question:
-        user_question = clean
+        user_question = clean_input(user_question)
+        with st.chat_message('user'):
+            st.markdown(user_question)
+        # An exact question needs no encoding; otherwise semantic retrieval
+        # first, lexical fuzzy matching as the fallback
+        best_match, score = find_exact_match(user_question, corpus)
+        if not best_match:
+            best_match, score = find_semantic_match(user_question, corpus, encoder, semantic_index)
+        if not best_match:
+            best_match, score = find_best_match(user_question, corpus)
+        with st.chat_message('assistant'):
+            if best_match:
+                answer, sheet = best_match
+                response = f"{answer}\n\n_Source: {sheet} (match score {score})_"
+                st.markdown(response)
+            elif gemini_model:
+                # Render Gemini's answer progressively; write_stream returns the full text
+                response = st.write_stream(generate_gemini_response(gemini_model, user_question))
+            else:
+                response = "Sorry, I couldn't find an answer to that question."
+                st.markdown(response)
+        st.session_state.history.append(('user', user_question))
+        st.session_state.history.append(('assistant', response))
+
+if __name__ == "__main__":
+    main()